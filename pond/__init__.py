@@ -12,6 +12,7 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from .host_capacity import HostCapacity as HostCapacity
 from .pond_class import Pond as Pond
 from .pooled_object import PooledObject as PooledObject
 from .pooled_object_factory import PooledObjectFactory as PooledObjectFactory
@@ -0,0 +1,159 @@
+"""
+Copyright 2022 Andy Qin. All Rights Reserved.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+
+class HostCapacity(object):
+    """
+    A semaphore shared by every process on the local machine, used to cap the
+    number of objects that all the Ponds on a host may create for one backend.
+    The state lives in a small JSON file, guarded by an exclusive `flock` on a
+    separate lock file, so it needs no external service. Each process records
+    how many objects it holds and when it last had to wait for capacity. The
+    file is replaced atomically, and entries of processes that are no longer
+    alive are dropped, so a crashed worker never leaks capacity. A corrupt
+    file is treated as empty.
+    An example usage:
+        capacity = HostCapacity("/tmp/db.capacity", limit=100)
+        pond.register(factory, host_capacity=capacity)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        limit: int,
+        timeout: float = 5,
+        rebalance_window: float = 1,
+    ) -> None:
+        """Initialize the host-wide capacity.
+
+        Args:
+            path (str): The file that stores the shared state. Every process
+                sharing the capacity must use the same path.
+            limit (int): The maximum number of objects on the host.
+            timeout (float, optional): How long borrow waits for capacity
+                before giving up. Defaults to 5.
+            rebalance_window (float, optional): How long, in seconds, a process
+                that was refused capacity makes the other processes give up
+                their idle objects. Defaults to 1.
+
+        Raises:
+            ValueError: The limit must be greater than zero!
+            RuntimeError: HostCapacity requires fcntl!
+        """
+        if limit < 1:
+            raise ValueError("The limit must be greater than zero!")
+        if fcntl is None:
+            raise RuntimeError("HostCapacity requires fcntl!")
+        self.path = path
+        self.limit = limit
+        self.timeout = timeout
+        self.rebalance_window = rebalance_window
+        self.__contended = False
+        self.__contended_checked_at = 0.0
+
+    @contextmanager
+    def __table(self) -> Iterator[Dict[str, Dict[str, float]]]:
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+b") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            table = self.__read_table()
+            yield table
+            directory = os.path.dirname(os.path.abspath(self.path))
+            tmp_fd, tmp_path = tempfile.mkstemp(prefix=".pond-", dir=directory)
+            try:
+                with os.fdopen(tmp_fd, "wb") as f:
+                    f.write(json.dumps(table).encode("utf-8"))
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def __read_table(self) -> Dict[str, Dict[str, float]]:
+        try:
+            with open(self.path, "rb") as f:
+                table = json.loads(f.read())
+            return {
+                pid: {"held": float(entry["held"]), "waiting": float(entry["waiting"])}
+                for pid, entry in table.items()
+                if self.__alive(int(pid))
+            }
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return {}
+
+    @staticmethod
+    def __alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def acquire(self, n: int = 1) -> bool:
+        """Try to take `n` units of capacity for this process.
+
+        Returns:
+            bool: True if the capacity was taken. False if the host is at its
+            limit, in which case the other processes are asked to give up
+            their idle objects.
+        """
+        with self.__table() as table:
+            entry = table.setdefault(str(os.getpid()), {"held": 0, "waiting": 0})
+            held = sum(value["held"] for value in table.values())
+            if held + n > self.limit:
+                entry["waiting"] = time.time()
+                return False
+            entry["held"] += n
+            entry["waiting"] = 0
+            return True
+
+    def release(self, n: int = 1) -> None:
+        """Give back `n` units of capacity taken by this process."""
+        with self.__table() as table:
+            entry = table.setdefault(str(os.getpid()), {"held": 0, "waiting": 0})
+            entry["held"] = max(entry["held"] - n, 0)
+
+    def in_use(self) -> int:
+        """Query how many units are held by all the processes on the host."""
+        with self.__table() as table:
+            return int(sum(value["held"] for value in table.values()))
+
+    def contended(self) -> bool:
+        """Return true if another process was recently refused capacity. The
+        answer is cached for a tenth of the rebalance window."""
+        now = time.time()
+        if now - self.__contended_checked_at < self.rebalance_window / 10:
+            return self.__contended
+        pid = str(os.getpid())
+        with self.__table() as table:
+            self.__contended = any(
+                now - value["waiting"] < self.rebalance_window
+                for key, value in table.items()
+                if key != pid
+            )
+        self.__contended_checked_at = now
+        return self.__contended
@@ -13,17 +13,37 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import asyncio
+import json
+import logging
 import math
+import mmap
+import os
+import tempfile
 import time
 from asyncio import AbstractEventLoop
-from collections import deque
-from threading import RLock, Thread
-from typing import TYPE_CHECKING, Any, Coroutine, Deque, Dict, Final, Optional
+from collections import OrderedDict, deque
+from queue import Empty, Queue
+from threading import Event, RLock, Thread
+from typing import (TYPE_CHECKING, Any, Coroutine, Deque, Dict, Final,
+                    Hashable, List, Optional, Set, Tuple)
+from weakref import WeakSet
 
 from .count_min_sketch import CountMinSketch
+from .host_capacity import HostCapacity
 from .pooled_object import PooledObject
 from .pooled_object_factory import PooledObjectFactory
 
+SNAPSHOT_VERSION: Final[int] = 1
+
+# The factory, host-wide capacity and borrowed objects of one registration. A
+# drained registration keeps them after its name has been registered again,
+# so objects it lent out are still destroyed by their own factory.
+Registration = Tuple[
+    PooledObjectFactory, Optional[HostCapacity], "WeakSet[PooledObject]"
+]
+
+logger = logging.getLogger(__name__)
+
 
 class Pond(object):
     def __init__(
@@ -33,6 +53,10 @@ class Pond(object):
         eviction_weight: float = 0.8,
         thread_daemon: bool = True,
         loop: Optional[AbstractEventLoop] = None,
+        snapshot_path: Optional[str] = None,
+        background_recycle: bool = False,
+        recycle_queue_maxsize: int = 1024,
+        destroy_batch_size: int = 64,
     ) -> None:
         """Pond is a high performance object-pooling library for Python, it has
             a smaller memory usage and a higher hit rate.For more details,
@@ -48,23 +72,71 @@ class Pond(object):
                 Defaults to 0.8.
             thread_daemon (bool, optional): A boolean value indicating whether
                 the pond's thread is a daemon thread. Defaults to True.
+            loop (Optional[AbstractEventLoop], optional): The event loop that
+                runs automatic recycling. Defaults to None.
+            snapshot_path (Optional[str], optional): The local file used to
+                persist the learned pool sizes and borrow frequencies across
+                restarts. A missing, unreadable or mismatched snapshot is
+                ignored. Defaults to None, which disables snapshots.
+            background_recycle (bool, optional): Whether to reset and destroy
+                returned objects on a background thread instead of inside
+                recycle and borrow. Defaults to False.
+            recycle_queue_maxsize (int, optional): The maximum number of
+                objects waiting for the background thread. recycle blocks
+                while the queue is full. Defaults to 1024.
+            destroy_batch_size (int, optional): The maximum number of queued
+                objects the background thread handles in one batch.
+                Defaults to 64.
         """
         self.__borrowed_timeout: int = borrowed_timeout
-        if loop is not None:
-            self.__loop = loop
-        else:
-            self.__loop = asyncio.new_event_loop()
         self.__time_between_eviction_runs = time_between_eviction_runs
+        if loop is None and time_between_eviction_runs > -1:
+            loop = asyncio.new_event_loop()
+        self.__loop: Optional[AbstractEventLoop] = loop
         self.__eviction_weight = eviction_weight
-        self.__async_lock = asyncio.Lock()
         self.__sync_lock = RLock()
+        self.__waiters: Dict[
+            str, Dict[AbstractEventLoop, Deque["asyncio.Future[None]"]]
+        ] = dict()
         self.__class_dict: Final[Dict[str, PooledObjectFactory]] = dict()
+        self.__host_capacity: Final[Dict[str, HostCapacity]] = dict()
+        self.__pooled_maxsize: Final[Dict[str, int]] = dict()
+        self.__min_idle: Final[Dict[str, int]] = dict()
+        self.__leases: Final[Dict[str, "WeakSet[PooledObject]"]] = dict()
+        self.__retired: Final[Dict[str, List[Registration]]] = dict()
+        self.__adjusting: Final[Set[str]] = set()
+        self.__thread_daemon = thread_daemon
+        self.__stopping = Event()
+        self.__rebalance_thread: Optional[Thread] = None
 
         if TYPE_CHECKING:
-            self.__pooled_object_tree: Final[Dict[str, Deque[PooledObject]]] = dict()
+            self.__pooled_object_tree: Final[
+                Dict[str, OrderedDict[PooledObject, None]]
+            ] = dict()
+            self.__affinity_index: Final[
+                Dict[str, Dict[Hashable, OrderedDict[PooledObject, None]]]
+            ] = dict()
         else:
-            self.__pooled_object_tree: Final[Dict[str, Deque]] = dict()
+            self.__pooled_object_tree: Final[Dict[str, OrderedDict]] = dict()
+            self.__affinity_index: Final[Dict[str, Dict[Hashable, OrderedDict]]] = (
+                dict()
+            )
+        self.__affinity_stats: Final[Dict[str, List[int]]] = dict()
         self.counter: CountMinSketch = CountMinSketch(28, 3)
+        self.__snapshot_path = snapshot_path
+        self.__learned_state: Dict[str, Dict[str, int]] = dict()
+        if snapshot_path is not None:
+            self.load_snapshot(snapshot_path)
+
+        self.__destroy_batch_size = destroy_batch_size
+        self.__recycle_queue: Optional[
+            "Queue[Optional[Tuple[str, PooledObject, bool, Dict[str, Any], Registration]]]"
+        ] = None
+        if background_recycle:
+            self.__recycle_queue = Queue(maxsize=recycle_queue_maxsize)
+            self.__recycle_thread = Thread(target=self.__recycle_worker)
+            self.__recycle_thread.daemon = thread_daemon
+            self.__recycle_thread.start()
 
         def loop_runner(
             loop: AbstractEventLoop, function: Coroutine[Any, Any, None]
@@ -81,19 +153,31 @@ class Pond(object):
             self.__thread.start()
 
     def register(
-        self, factory: Optional[PooledObjectFactory] = None, name: Optional[str] = None
+        self,
+        factory: Optional[PooledObjectFactory] = None,
+        name: Optional[str] = None,
+        prefill: bool = True,
+        host_capacity: Optional[HostCapacity] = None,
     ) -> None:
         """Registering the factory object with Pond will use the class name of
             the factory as the key for the PooledObjectTree by default.After
             successful registration, Pond will automatically start creating
             objects based on the pooled_maxsize set in factory until the pool
-            is filled.
+            is filled. If a snapshot has been loaded, the pool is only filled
+            up to the size it had learned before the restart.
 
         Args:
             factory (Optional[PooledObjectFactory], optional): The factory
                 object you want to register. Defaults to None.
             name (Optional[str], optional): The factory name you want to register.
                 Defaults to None.
+            prefill (bool, optional): Whether to fill the pool right away. Pass
+                False and call warm_up later to fill the hottest pools first.
+                Defaults to True.
+            host_capacity (Optional[HostCapacity], optional): The capacity
+                shared with the other processes on this machine. The pool
+                stops filling once the host-wide limit is reached. Defaults
+                to None.
 
         Raises:
             ValueError: The factoryClass existed in the PooledObjectTree!
@@ -103,18 +187,315 @@ class Pond(object):
             assert factory is not None
             name = factory.factory_name()
         assert factory is not None
-        if self.__pooled_object_tree.__contains__(name):
-            raise ValueError("The factoryClass existed in the PooledObjectTree!")
-        self.__class_dict[name] = factory
-        self.__pooled_object_tree[name] = deque(maxlen=factory.pooled_maxsize)
-        for i in range(factory.pooled_maxsize):
-            instance = self.__class_dict[name].createInstance()
+        with self.__sync_lock:
+            if self.__pooled_object_tree.__contains__(name):
+                raise ValueError("The factoryClass existed in the PooledObjectTree!")
+            self.__class_dict[name] = factory
+            if host_capacity is not None:
+                self.__host_capacity[name] = host_capacity
+                if self.__rebalance_thread is None:
+                    self.__rebalance_thread = Thread(target=self.__rebalance_worker)
+                    self.__rebalance_thread.daemon = self.__thread_daemon
+                    self.__rebalance_thread.start()
+            self.__pooled_maxsize[name] = factory.pooled_maxsize
+            self.__min_idle[name] = 1 if factory.least_one else 0
+            self.__leases[name] = WeakSet()
+            self.__pooled_object_tree[name] = OrderedDict()
+            self.__affinity_index[name] = dict()
+            self.__affinity_stats[name] = [0, 0]
+            learned = self.__learned_state.get(name)
+            if learned is not None and self.__time_between_eviction_runs > -1:
+                self.counter.sketch[name] = learned["count"]
+        if prefill:
+            self.__fill(name, self.__learned_size(name))
+
+    def warm_up(self) -> None:
+        """Fill every registered object pool up to the size it learned before
+        the restart, starting with the most frequently borrowed pool."""
+        with self.__sync_lock:
+            names = list(self.__pooled_object_tree.keys())
+        names.sort(
+            key=lambda key: self.__learned_state.get(key, {}).get("count", 0),
+            reverse=True,
+        )
+        for name in names:
+            self.__fill(name, self.__learned_size(name))
+
+    def __learned_size(self, name: str) -> int:
+        with self.__sync_lock:
+            maxsize = self.__pooled_maxsize.get(name)
+            if maxsize is None:
+                return 0
+            learned = self.__learned_state.get(name)
+            if learned is None:
+                return maxsize
+            return max(min(learned["size"], maxsize), self.__min_idle[name])
+
+    def __fill(self, name: str, size: int) -> None:
+        while True:
+            with self.__sync_lock:
+                registration = self.__registration(name)
+                pooled_objects = self.__pooled_object_tree.get(name)
+                if registration is None or pooled_objects is None:
+                    return
+                if len(pooled_objects) >= size:
+                    return
+            instance = self.__create(registration)
+            if instance is None:
+                return
+            with self.__sync_lock:
+                pooled_objects = self.__pooled_object_tree.get(name)
+                if (
+                    pooled_objects is not None
+                    and self.__is_current(registration, name)
+                    and len(pooled_objects) < size
+                ):
+                    pooled_objects[instance] = None
+                    pooled_objects.move_to_end(instance, last=False)
+                    self.__index(instance, name=name, last=False)
+                    self.__notify_waiter(name)
+                    continue
+            self.__clear_one_object(instance, registration)
+            return
+
+    def __registration(self, name: str) -> Optional[Registration]:
+        # Must be called with the lock held. Returns None when the name is not
+        # registered.
+        factory = self.__class_dict.get(name)
+        if factory is None:
+            return None
+        return factory, self.__host_capacity.get(name), self.__leases[name]
+
+    def __is_current(self, registration: Registration, name: str) -> bool:
+        # Must be called with the lock held.
+        return self.__leases.get(name) is registration[2]
+
+    def __owner(
+        self, pooled_object: PooledObject, name: str
+    ) -> Optional[Registration]:
+        # Must be called with the lock held. Finds the registration that lent
+        # out the object. An object that was never borrowed belongs to the
+        # current registration, if there is one.
+        retired = self.__retired.get(name, [])
+        retired[:] = [registration for registration in retired if registration[2]]
+        for registration in retired:
+            if pooled_object in registration[2]:
+                return registration
+        if not retired:
+            self.__retired.pop(name, None)
+        return self.__registration(name)
+
+    def __create(self, registration: Registration) -> Optional[PooledObject]:
+        # Returns None when the host-wide capacity of the pool is exhausted.
+        factory, host_capacity, _ = registration
+        if host_capacity is not None and not host_capacity.acquire():
+            return None
+        try:
+            instance = factory.createInstance()
             if instance is None:
                 raise ValueError("The instance must not be null!")
-            self.__pooled_object_tree[name].appendleft(instance)
+        except BaseException:
+            if host_capacity is not None:
+                host_capacity.release()
+            raise
+        return instance
+
+    def __rebalance_worker(self) -> None:
+        # A worker whose pool is full and idle never recycles, so it gives up
+        # its idle objects to busier processes on the host from here, one per
+        # tenth of the rebalance window, down to min_idle.
+        while True:
+            with self.__sync_lock:
+                capacities = list(self.__host_capacity.items())
+            interval = min(
+                (host_capacity.rebalance_window for _, host_capacity in capacities),
+                default=1,
+            )
+            for name, host_capacity in capacities:
+                if not host_capacity.contended():
+                    continue
+                with self.__sync_lock:
+                    registration = self.__registration(name)
+                    pooled_objects = self.__pooled_object_tree.get(name)
+                    if registration is None or pooled_objects is None:
+                        continue
+                    if len(pooled_objects) <= self.__min_idle[name]:
+                        continue
+                    surplus_object = self.__pop(name, last=False)
+                    assert surplus_object is not None
+                try:
+                    self.__clear_one_object(surplus_object, registration)
+                except Exception:
+                    logger.exception("Failed to destroy a pooled object of %s", name)
+            if self.__stopping.wait(interval / 10):
+                return
+
+    def resize(
+        self,
+        factory: Optional[PooledObjectFactory] = None,
+        name: Optional[str] = None,
+        maxsize: Optional[int] = None,
+        min_idle: Optional[int] = None,
+    ) -> None:
+        """Change the size of a registered object pool while it is in use.
+            Growing to min_idle and shrinking to maxsize happen on a
+            background thread, one object at a time, so borrowers are never
+            blocked and the warm objects that fit are kept.
+
+        Args:
+            factory (Optional[PooledObjectFactory], optional): The specified factory object. Defaults to None.
+            name (Optional[str], optional): The specified factory name. Defaults to None.
+            maxsize (Optional[int], optional): The new maximum number of idle
+                objects. Defaults to None, which keeps the current value.
+            min_idle (Optional[int], optional): The number of idle objects
+                kept by automatic recycling. Defaults to None, which keeps
+                the current value.
+
+        Raises:
+            ValueError: The factoryClass not existed in the PooledObjectTree!
+            ValueError: The min_idle must not exceed the maxsize!
+        """
+        if not name:
+            assert factory is not None
+            name = factory.factory_name()
+        with self.__sync_lock:
+            if name not in self.__pooled_object_tree:
+                raise ValueError(
+                    "The factoryClass not existed in the PooledObjectTree!"
+                )
+            if maxsize is None:
+                maxsize = self.__pooled_maxsize[name]
+            if min_idle is None:
+                min_idle = min(self.__min_idle[name], maxsize)
+            if min_idle < 0 or min_idle > maxsize:
+                raise ValueError("The min_idle must not exceed the maxsize!")
+            self.__pooled_maxsize[name] = maxsize
+            self.__min_idle[name] = min_idle
+            # A running adjuster picks up the new targets on its next step.
+            if name in self.__adjusting:
+                return
+            self.__adjusting.add(name)
+        thread = Thread(target=self.__adjust_pool, args=(name,))
+        thread.daemon = self.__thread_daemon
+        thread.start()
+
+    def __adjust_pool(self, name: str) -> None:
+        try:
+            while True:
+                with self.__sync_lock:
+                    registration = self.__registration(name)
+                    pooled_objects = self.__pooled_object_tree.get(name)
+                    if registration is None or pooled_objects is None:
+                        return
+                    if len(pooled_objects) > self.__pooled_maxsize[name]:
+                        surplus_object = self.__pop(name, last=False)
+                    elif len(pooled_objects) < self.__min_idle[name]:
+                        surplus_object = None
+                    else:
+                        return
+                if surplus_object is not None:
+                    self.__clear_one_object(surplus_object, registration)
+                    continue
+                instance = self.__create(registration)
+                if instance is not None:
+                    if self.__put_back(instance, name, registration):
+                        continue
+                    self.__clear_one_object(instance, registration)
+                with self.__sync_lock:
+                    # Growing is blocked by the host-wide capacity or a full
+                    # pool, only keep going if the pool still has to shrink.
+                    pooled_objects = self.__pooled_object_tree.get(name)
+                    if pooled_objects is None or len(pooled_objects) <= (
+                        self.__pooled_maxsize[name]
+                    ):
+                        return
+        except Exception:
+            # There is no caller to raise to on this thread.
+            logger.exception("Failed to resize the pool of %s", name)
+        finally:
+            with self.__sync_lock:
+                self.__adjusting.discard(name)
+
+    def unregister(
+        self,
+        factory: Optional[PooledObjectFactory] = None,
+        name: Optional[str] = None,
+        drain: bool = True,
+    ) -> None:
+        """Remove an object pool from Pond. Its idle objects are destroyed
+            and it can no longer be borrowed from.
+
+        Args:
+            factory (Optional[PooledObjectFactory], optional): The specified factory object. Defaults to None.
+            name (Optional[str], optional): The specified factory name. Defaults to None.
+            drain (bool, optional): Whether to keep the factory until every
+                borrowed object has been recycled, so that each one is
+                destroyed when it comes back. If False, the factory is
+                forgotten at once, the host-wide capacity held by borrowed
+                objects is released and recycling them raises. Defaults to
+                True.
+
+        Raises:
+            ValueError: The factoryClass not existed in the PooledObjectTree!
+        """
+        if not name:
+            assert factory is not None
+            name = factory.factory_name()
+        with self.__sync_lock:
+            registration = self.__registration(name)
+            if registration is None:
+                raise ValueError(
+                    "The factoryClass not existed in the PooledObjectTree!"
+                )
+            pooled_objects = self.__pooled_object_tree[name]
+            _, host_capacity, leases = registration
+            outstanding = 0
+            if drain and leases:
+                # Objects still borrowed are destroyed by this registration
+                # when they come back, even if the name is registered again.
+                self.__retired.setdefault(name, []).append(registration)
+            else:
+                outstanding = len(leases)
+            self.__forget(name)
+        for pooled_object in pooled_objects:
+            self.__clear_one_object(pooled_object, registration)
+        if host_capacity is not None and outstanding > 0:
+            host_capacity.release(outstanding)
+
+    def __end_lease(
+        self, pooled_object: PooledObject, name: str, registration: Registration
+    ) -> None:
+        # Called once a borrowed object is back in the pool or destroyed. A
+        # drained registration is dropped with its last lease.
+        with self.__sync_lock:
+            leases = registration[2]
+            leases.discard(pooled_object)
+            retired = self.__retired.get(name)
+            if leases or retired is None:
+                return
+            retired[:] = [other for other in retired if other[2] is not leases]
+            if not retired:
+                del self.__retired[name]
+
+    def __forget(self, name: str) -> None:
+        for mapping in (
+            self.__pooled_object_tree,
+            self.__affinity_index,
+            self.__class_dict,
+            self.__host_capacity,
+            self.__pooled_maxsize,
+            self.__min_idle,
+            self.__leases,
+            self.__waiters,
+            self.__affinity_stats,
+        ):
+            mapping.pop(name, None)
 
     def borrow(
-        self, factory: Optional[PooledObjectFactory] = None, name: Optional[str] = None
+        self,
+        factory: Optional[PooledObjectFactory] = None,
+        name: Optional[str] = None,
+        affinity: Optional[Hashable] = None,
     ) -> PooledObject:
         """You can use factory object or factory name to borrow and return
             objects from the object pool.
@@ -124,28 +505,118 @@ class Pond(object):
                 object you want to register. Defaults to None.
             name (Optional[str], optional): The factory name you want to register.
                 Defaults to None.
+            affinity (Optional[Hashable], optional): A key such as a tenant or
+                caller id. An idle object last borrowed with the same key is
+                preferred, then one never borrowed with a key, and only then
+                any idle object. Defaults to None.
+
+        Raises:
+            ValueError: The factoryClass not existed in the PooledObjectTree!
+            RuntimeError: The host-wide object capacity is exhausted!
 
         Returns:
             PooledObject: The pooled object you want to borrow.
         """
+        if not name:
+            assert factory is not None
+            name = factory.factory_name()
+        pooled_object = self.__try_borrow(name, affinity=affinity)
+        if pooled_object is not None:
+            return pooled_object
+        deadline = time.time() + self.__capacity_timeout(name)
+        next_attempt, backoff = time.time(), 0.01
+        while time.time() < deadline:
+            time.sleep(0.01)
+            if not self.__has_idle(name) and time.time() < next_attempt:
+                continue
+            pooled_object = self.__try_borrow(name, count=False, affinity=affinity)
+            if pooled_object is not None:
+                return pooled_object
+            next_attempt, backoff = self.__capacity_backoff(backoff)
+        raise RuntimeError("The host-wide object capacity is exhausted!")
+
+    def __has_idle(self, name: str) -> bool:
+        with self.__sync_lock:
+            pooled_objects = self.__pooled_object_tree.get(name)
+            if pooled_objects is None:
+                raise ValueError(
+                    "The factoryClass not existed in the PooledObjectTree!"
+                )
+            return bool(pooled_objects)
+
+    def __capacity_timeout(self, name: str) -> float:
+        # Only called once a borrow was refused by the host-wide capacity.
         with self.__sync_lock:
-            if not name:
-                assert factory is not None
-                name = factory.factory_name()
-            if self.is_empty(name=name):
-                if self.__time_between_eviction_runs > -1:
-                    self.counter.add(name)
-                return self.__class_dict[name].createInstance()
-            pooled_object = self.__pooled_object_tree[name].pop()
-            while not self.__class_dict[name].validate(pooled_object):
-                self.__clear_one_object(pooled_object, name=name)
-                if self.is_empty(name=name):
-                    pooled_object = self.__class_dict[name].createInstance()
-                else:
-                    pooled_object = self.__pooled_object_tree[name].pop()
-            if self.__time_between_eviction_runs > -1:
+            host_capacity = self.__host_capacity.get(name)
+        if host_capacity is None:
+            raise ValueError("The factoryClass not existed in the PooledObjectTree!")
+        return host_capacity.timeout
+
+    @staticmethod
+    def __capacity_backoff(backoff: float) -> Tuple[float, float]:
+        # While the host is at its limit, only a local recycle is picked up
+        # every 10ms. The shared capacity file is retried with exponential
+        # backoff, so waiting workers do not hammer it.
+        backoff = min(backoff * 2, 0.5)
+        return time.time() + backoff, backoff
+
+    def __try_borrow(
+        self, name: str, count: bool = True, affinity: Optional[Hashable] = None
+    ) -> Optional[PooledObject]:
+        # Returns None when the pool is empty and no object may be created.
+        invalid_objects: List[PooledObject] = []
+        with self.__sync_lock:
+            registration = self.__registration(name)
+            if registration is None:
+                raise ValueError(
+                    "The factoryClass not existed in the PooledObjectTree!"
+                )
+            if count and self.__time_between_eviction_runs > -1:
                 self.counter.add(name)
-            return pooled_object.update_brrow_time()
+            pooled_object = self.__pop(name, affinity=affinity)
+            factory, _, leases = registration
+            if pooled_object is not None:
+                leases.add(pooled_object)
+            affinity_stats = self.__affinity_stats[name]
+            if count and affinity is not None:
+                affinity_stats[0] += 1
+        # Creating, validating and destroying objects happen outside the lock,
+        # so slow factories never stall borrowers of other pools or loops.
+        if pooled_object is None:
+            pooled_object = self.__create(registration)
+            if pooled_object is None:
+                return None
+            if affinity is not None:
+                pooled_object.affinity = affinity
+            with self.__sync_lock:
+                leases.add(pooled_object)
+            return pooled_object
+        while not factory.validate(pooled_object):
+            # The invalid object stays leased until it has been destroyed.
+            invalid_objects.append(pooled_object)
+            with self.__sync_lock:
+                pooled_object = None
+                if self.__is_current(registration, name):
+                    pooled_object = self.__pop(name, affinity=affinity)
+                if pooled_object is not None:
+                    leases.add(pooled_object)
+            if pooled_object is None:
+                pooled_object = self.__create(registration)
+                if pooled_object is None:
+                    break
+                with self.__sync_lock:
+                    leases.add(pooled_object)
+        for invalid_object in invalid_objects:
+            self.__discard(invalid_object, name, registration)
+        if pooled_object is None:
+            return None
+        if affinity is not None:
+            # Only an object that passed validation counts as a hit.
+            if count and pooled_object.affinity == affinity:
+                with self.__sync_lock:
+                    affinity_stats[1] += 1
+            pooled_object.affinity = affinity
+        return pooled_object.update_brrow_time()
 
     def recycle(
         self,
@@ -165,22 +636,186 @@ class Pond(object):
                 Defaults to None.
             kwargs (Any): The parameters you want to pass to the reset method.
         """
+        if not name:
+            assert factory is not None
+            name = factory.factory_name()
+        if not isinstance(pooled_object, PooledObject):
+            raise ValueError("Only PooledObject can be recycled!")
         with self.__sync_lock:
-            if not name:
-                assert factory is not None
-                name = factory.factory_name()
-            if not isinstance(pooled_object, PooledObject):
-                raise ValueError("Only PooledObject can be recycled!")
-            if self.is_full(name=name):
-                self.__clear_one_object(pooled_object, name=name)
-                return
-            if (time.time() - pooled_object.last_borrow_time) > self.__borrowed_timeout:
-                self.__clear_one_object(pooled_object, name=name)
+            registration = self.__owner(pooled_object, name)
+            if registration is None:
+                raise ValueError(
+                    "The factoryClass not existed in the PooledObjectTree!"
+                )
+            # A drained registration destroys every returned object.
+            expired = (
+                not self.__is_current(registration, name)
+                or self.is_full(name=name)
+                or (time.time() - pooled_object.last_borrow_time)
+                > self.__borrowed_timeout
+            )
+            has_idle = not expired and not self.is_empty(name=name)
+        host_capacity = registration[1]
+        if host_capacity is not None and not expired:
+            # Hand idle capacity over to busier processes on the host.
+            expired = has_idle and host_capacity.contended()
+        recycle_queue = self.__recycle_queue
+        if recycle_queue is not None:
+            # The background thread ends the lease.
+            recycle_queue.put((name, pooled_object, expired, kwargs, registration))
+            return
+        try:
+            if not expired:
+                try:
+                    reset_object = registration[0].reset(pooled_object, **kwargs)
+                except BaseException:
+                    # Never pool an object that failed to reset, and give its
+                    # capacity back, as the background thread does.
+                    self.__clear_one_object(pooled_object, registration)
+                    raise
+                if self.__put_back(reset_object, name, registration):
+                    return
+            self.__clear_one_object(pooled_object, registration)
+        finally:
+            self.__end_lease(pooled_object, name, registration)
+
+    def __pop(
+        self, name: str, last: bool = True, affinity: Optional[Hashable] = None
+    ) -> Optional[PooledObject]:
+        # Must be called with the lock held. Prefers the most recently returned
+        # idle object that was last borrowed with the same affinity, then one
+        # that was never borrowed with any, so that a new key does not take
+        # another key's warm object while a fresh one is idle.
+        pooled_objects = self.__pooled_object_tree[name]
+        if not pooled_objects:
+            return None
+        affinity_index = self.__affinity_index[name]
+        if affinity is not None:
+            for key in (affinity, None):
+                same_affinity = affinity_index.get(key)
+                if same_affinity:
+                    pooled_object = same_affinity.popitem()[0]
+                    if not same_affinity:
+                        del affinity_index[key]
+                    del pooled_objects[pooled_object]
+                    return pooled_object
+        pooled_object = pooled_objects.popitem(last=last)[0]
+        same_affinity = affinity_index.get(pooled_object.affinity)
+        if same_affinity is not None:
+            same_affinity.pop(pooled_object, None)
+            if not same_affinity:
+                del affinity_index[pooled_object.affinity]
+        return pooled_object
+
+    def __index(
+        self, pooled_object: PooledObject, name: str, last: bool = True
+    ) -> None:
+        # Must be called with the lock held. Every idle object is indexed by
+        # the affinity it was last borrowed with, None if it never had one.
+        same_affinity = self.__affinity_index[name].setdefault(
+            pooled_object.affinity, OrderedDict()
+        )
+        same_affinity[pooled_object] = None
+        same_affinity.move_to_end(pooled_object, last=last)
+
+    def __put_back(
+        self, pooled_object: PooledObject, name: str, registration: Registration
+    ) -> bool:
+        with self.__sync_lock:
+            if not self.__is_current(registration, name) or self.is_full(name=name):
+                return False
+            self.__pooled_object_tree[name][pooled_object] = None
+            self.__index(pooled_object, name=name)
+            self.__notify_waiter(name)
+            return True
+
+    def __notify_waiter(self, name: str) -> None:
+        # Wake one waiter, visiting the event loops in turn so that no loop
+        # starves the others. The loop that is woken moves to the back.
+        loop_waiters = self.__waiters.get(name)
+        if not loop_waiters:
+            return
+        for loop in list(loop_waiters.keys()):
+            waiters = loop_waiters.pop(loop)
+            while waiters:
+                waiter = waiters.popleft()
+                if waiter.done():
+                    continue
+                if waiters:
+                    loop_waiters[loop] = waiters
+                try:
+                    loop.call_soon_threadsafe(self.__wake_waiter, waiter, name)
+                except RuntimeError:
+                    # The loop has been closed, try the next one.
+                    break
                 return
 
-            self.__pooled_object_tree[name].append(
-                self.__class_dict[name].reset(pooled_object, **kwargs)
-            )
+    def __wake_waiter(self, waiter: "asyncio.Future[None]", name: str) -> None:
+        if not waiter.done():
+            waiter.set_result(None)
+            return
+        # The waiter gave up before the wakeup arrived, pass it on.
+        with self.__sync_lock:
+            if self.__pooled_object_tree.get(name):
+                self.__notify_waiter(name)
+
+    def join_recycle(self) -> None:
+        """Block until every object queued for the background thread has been
+        reset or destroyed. Returns at once if background_recycle is off."""
+        recycle_queue = self.__recycle_queue
+        if recycle_queue is not None:
+            recycle_queue.join()
+
+    def __discard(
+        self, pooled_object: PooledObject, name: str, registration: Registration
+    ) -> None:
+        recycle_queue = self.__recycle_queue
+        if recycle_queue is not None:
+            recycle_queue.put((name, pooled_object, True, {}, registration))
+            return
+        try:
+            self.__clear_one_object(pooled_object, registration)
+        finally:
+            self.__end_lease(pooled_object, name, registration)
+
+    def __recycle_worker(self) -> None:
+        recycle_queue = self.__recycle_queue
+        assert recycle_queue is not None
+        running = True
+        while running:
+            batch = [recycle_queue.get()]
+            while len(batch) < self.__destroy_batch_size:
+                try:
+                    batch.append(recycle_queue.get_nowait())
+                except Empty:
+                    break
+            destroyed_objects: List[Tuple[str, PooledObject, Registration]] = []
+            for item in batch:
+                if item is None:
+                    running = False
+                    continue
+                name, pooled_object, expired, kwargs, registration = item
+                if not expired:
+                    try:
+                        reset_object = registration[0].reset(pooled_object, **kwargs)
+                    except Exception:
+                        logger.exception("Failed to reset a pooled object of %s", name)
+                        expired = True
+                # The object only becomes borrowable once it has been reset.
+                if not expired and self.__put_back(reset_object, name, registration):
+                    self.__end_lease(pooled_object, name, registration)
+                    continue
+                destroyed_objects.append((name, pooled_object, registration))
+            for name, pooled_object, registration in destroyed_objects:
+                try:
+                    self.__clear_one_object(pooled_object, registration)
+                except Exception:
+                    # There is no caller to raise to on this thread.
+                    logger.exception("Failed to destroy a pooled object of %s", name)
+                finally:
+                    self.__end_lease(pooled_object, name, registration)
+            for _ in batch:
+                recycle_queue.task_done()
 
     def clear(
         self, factory: Optional[PooledObjectFactory] = None, name: Optional[str] = None
@@ -196,21 +831,26 @@ class Pond(object):
         if not name:
             assert factory is not None
             name = factory.factory_name()
-        while not self.is_empty(name=name):
-            pooled_object = self.__pooled_object_tree[name].pop()
-            self.__clear_one_object(pooled_object, name=name)
+        while True:
+            with self.__sync_lock:
+                registration = self.__registration(name)
+                if registration is None:
+                    return
+                pooled_object = self.__pop(name)
+            if pooled_object is None:
+                return
+            self.__clear_one_object(pooled_object, registration)
 
     def __clear_one_object(
-        self,
-        pooled_object: PooledObject,
-        factory: Optional[PooledObjectFactory] = None,
-        name: Optional[str] = None,
+        self, pooled_object: PooledObject, registration: Registration
     ) -> None:
-        if not name:
-            assert factory is not None
-            name = factory.factory_name()
-        self.__class_dict[name].destroy(pooled_object)
-        del pooled_object
+        factory, host_capacity, _ = registration
+        try:
+            factory.destroy(pooled_object)
+        finally:
+            del pooled_object
+            if host_capacity is not None:
+                host_capacity.release()
 
     def size(self) -> int:
         """Query how many object pools there are in pooled_object_tree."""
@@ -219,8 +859,9 @@ class Pond(object):
     def count_total_objects(self) -> int:
         """Query how many objects there are in pooled_object_tree."""
         total_number = 0
-        for k, v in self.__pooled_object_tree.items():
-            total_number = total_number + len(v)
+        with self.__sync_lock:
+            for k, v in self.__pooled_object_tree.items():
+                total_number = total_number + len(v)
         return total_number
 
     def contains(
@@ -257,6 +898,37 @@ class Pond(object):
             name = factory.factory_name()
         return len(self.__pooled_object_tree[name])
 
+    def stats(
+        self, factory: Optional[PooledObjectFactory] = None, name: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Query the statistics of the specified object pool.
+
+        Args:
+            factory (Optional[PooledObjectFactory], optional): The specified factory object. Defaults to None.
+            name (Optional[str], optional): The specified factory name. Defaults to None.
+
+        Returns:
+            Dict[str, Any]: The number of idle and borrowed objects, the size
+            limits, and how often a borrow with an affinity found an idle
+            object last borrowed with the same affinity.
+        """
+        if not name:
+            assert factory is not None
+            name = factory.factory_name()
+        with self.__sync_lock:
+            affinity_requests, affinity_hits = self.__affinity_stats[name]
+            return {
+                "idle": len(self.__pooled_object_tree[name]),
+                "leased": len(self.__leases[name]),
+                "maxsize": self.__pooled_maxsize[name],
+                "min_idle": self.__min_idle[name],
+                "affinity_requests": affinity_requests,
+                "affinity_hits": affinity_hits,
+                "affinity_hit_rate": (
+                    affinity_hits / affinity_requests if affinity_requests else 0.0
+                ),
+            }
+
     def is_full(
         self, factory: Optional[PooledObjectFactory] = None, name: Optional[str] = None
     ) -> bool:
@@ -272,9 +944,7 @@ class Pond(object):
         if not name:
             assert factory is not None
             name = factory.factory_name()
-        return len(self.__pooled_object_tree[name]) >= (
-            self.__pooled_object_tree[name].maxlen or 0
-        )
+        return len(self.__pooled_object_tree[name]) >= self.__pooled_maxsize[name]
 
     def is_empty(
         self, factory: Optional[PooledObjectFactory] = None, name: Optional[str] = None
@@ -304,13 +974,100 @@ class Pond(object):
         m = math.ceil(math.e / epsilon)
         d = math.ceil(math.log(1 / 0.1))
         if not m == self.counter.m or not d == self.counter.d:
-            self.counter = CountMinSketch(m, d)
+            with self.__sync_lock:
+                self.counter = CountMinSketch(m, d)
+
+    def save_snapshot(self, path: Optional[str] = None) -> None:
+        """Persist the current size and borrow frequency of every object pool.
+            The size counts both idle and borrowed objects, so a pool under
+            heavy demand is not mistaken for an idle one. The file is replaced
+            atomically, so a crash never leaves a torn snapshot behind.
+
+        Args:
+            path (Optional[str], optional): The snapshot file. Defaults to the
+                snapshot_path passed to Pond.
+
+        Raises:
+            ValueError: The snapshot path must not be null!
+        """
+        path = path or self.__snapshot_path
+        if path is None:
+            raise ValueError("The snapshot path must not be null!")
+        with self.__sync_lock:
+            pools = {
+                key: {
+                    "size": len(value) + len(self.__leases[key]),
+                    "count": self.counter[key],
+                }
+                for key, value in self.__pooled_object_tree.items()
+            }
+        data = json.dumps({"version": SNAPSHOT_VERSION, "pools": pools})
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".pond-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def load_snapshot(self, path: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """Load the learned pool sizes and borrow frequencies from a snapshot.
+            Pools registered afterwards are filled to their learned size. A
+            missing, unreadable or mismatched snapshot is ignored, and the
+            pools fall back to their pooled_maxsize.
+
+        Args:
+            path (Optional[str], optional): The snapshot file. Defaults to the
+                snapshot_path passed to Pond.
+
+        Raises:
+            ValueError: The snapshot path must not be null!
+
+        Returns:
+            Dict[str, Dict[str, int]]: The learned size and count of each pool.
+        """
+        path = path or self.__snapshot_path
+        if path is None:
+            raise ValueError("The snapshot path must not be null!")
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return self.__learned_state
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    snapshot = json.loads(m[:])
+            if snapshot["version"] != SNAPSHOT_VERSION:
+                return self.__learned_state
+            learned_state = {
+                str(key): {"size": int(value["size"]), "count": int(value["count"])}
+                for key, value in snapshot["pools"].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return self.__learned_state
+        self.__learned_state = learned_state
+        return self.__learned_state
 
     def stop(self) -> None:
         """Stop the pone and all objects in the pooled object tree will be destroyed."""
-        self.__loop.stop()
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
         self.__time_between_eviction_runs = -1
-        for key in self.__pooled_object_tree.keys():
+        self.__stopping.set()
+        if self.__rebalance_thread is not None:
+            self.__rebalance_thread.join()
+        recycle_queue = self.__recycle_queue
+        if recycle_queue is not None:
+            recycle_queue.put(None)
+            self.__recycle_thread.join()
+            self.__recycle_queue = None
+        if self.__snapshot_path is not None:
+            self.save_snapshot()
+        with self.__sync_lock:
+            names = list(self.__pooled_object_tree.keys())
+        for key in names:
             self.clear(name=key)
 
     async def __eviction(self, debug: bool = False) -> None:
@@ -322,21 +1079,29 @@ class Pond(object):
                 continue
             pooled_object_borrow_count: Dict[str, int] = {}
             max_count = 8
-            for key in self.__pooled_object_tree.keys():
-                pooled_object_borrow_count[key] = self.counter[key]
+            with self.__sync_lock:
+                for key in self.__pooled_object_tree.keys():
+                    pooled_object_borrow_count[key] = self.counter[key]
             boundary = int(max_count * self.__eviction_weight)
             for key, value in pooled_object_borrow_count.items():
-                size = len(self.__pooled_object_tree[key])
-                if value < boundary and size > 0:
-                    if size > 1:
-                        for i in range(int(size / 2)):
-                            self.__clear_one_object(
-                                self.__pooled_object_tree[key].pop(),
-                                name=key,
-                            )
-                    else:
-                        if not self.__class_dict[key].least_one:
-                            self.clear(name=key)
+                evicted_objects: List[PooledObject] = []
+                with self.__sync_lock:
+                    registration = self.__registration(key)
+                    pooled_objects = self.__pooled_object_tree.get(key)
+                    if registration is None or pooled_objects is None:
+                        continue
+                    size = len(pooled_objects)
+                    min_idle = self.__min_idle[key]
+                    if value < boundary and size > min_idle:
+                        evicted = int(size / 2) if size > 1 else 1
+                        for i in range(min(evicted, size - min_idle)):
+                            evicted_object = self.__pop(key)
+                            assert evicted_object is not None
+                            evicted_objects.append(evicted_object)
+                for pooled_object in evicted_objects:
+                    self.__clear_one_object(pooled_object, registration)
+            if self.__snapshot_path is not None:
+                self.save_snapshot()
             self.__reset_counter()
             if debug:
                 self.__time_between_eviction_runs = -1
@@ -345,14 +1110,88 @@ class Pond(object):
     async def async_register(
         self, factory: Optional[PooledObjectFactory] = None, name: Optional[str] = None
     ) -> None:
-        async with self.__async_lock:
-            self.register(factory=factory, name=name)
+        self.register(factory=factory, name=name)
 
     async def async_borrow(
-        self, factory: Optional[PooledObjectFactory] = None, name: Optional[str] = None
+        self,
+        factory: Optional[PooledObjectFactory] = None,
+        name: Optional[str] = None,
+        timeout: Optional[float] = None,
+        affinity: Optional[Hashable] = None,
     ) -> PooledObject:
-        async with self.__async_lock:
-            return self.borrow(factory=factory, name=name)
+        """Borrow an object from any event loop. One Pond can be shared by
+            event loops running in different threads.
+
+        Args:
+            factory (Optional[PooledObjectFactory], optional): The factory
+                object you want to register. Defaults to None.
+            name (Optional[str], optional): The factory name you want to register.
+                Defaults to None.
+            timeout (Optional[float], optional): How long to wait for an
+                object to be recycled when the pool is empty before creating
+                a new one. Defaults to None, which creates one right away.
+            affinity (Optional[Hashable], optional): A key such as a tenant or
+                caller id, see borrow. Defaults to None.
+
+        Raises:
+            ValueError: The factoryClass not existed in the PooledObjectTree!
+            RuntimeError: The host-wide object capacity is exhausted!
+
+        Returns:
+            PooledObject: The pooled object you want to borrow.
+        """
+        if not name:
+            assert factory is not None
+            name = factory.factory_name()
+        if timeout is None:
+            return await self.__async_borrow_within_capacity(name, affinity)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self.__sync_lock:
+                if self.__has_idle(name):
+                    break
+                waiter: "asyncio.Future[None]" = loop.create_future()
+                loop_waiters = self.__waiters.setdefault(name, dict())
+                loop_waiters.setdefault(loop, deque()).append(waiter)
+            try:
+                await asyncio.wait_for(waiter, max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                break
+            finally:
+                with self.__sync_lock:
+                    self.__remove_waiter(name, loop, waiter)
+        return await self.__async_borrow_within_capacity(name, affinity)
+
+    async def __async_borrow_within_capacity(
+        self, name: str, affinity: Optional[Hashable]
+    ) -> PooledObject:
+        pooled_object = self.__try_borrow(name, affinity=affinity)
+        if pooled_object is not None:
+            return pooled_object
+        deadline = time.time() + self.__capacity_timeout(name)
+        next_attempt, backoff = time.time(), 0.01
+        while time.time() < deadline:
+            await asyncio.sleep(0.01)
+            if not self.__has_idle(name) and time.time() < next_attempt:
+                continue
+            pooled_object = self.__try_borrow(name, count=False, affinity=affinity)
+            if pooled_object is not None:
+                return pooled_object
+            next_attempt, backoff = self.__capacity_backoff(backoff)
+        raise RuntimeError("The host-wide object capacity is exhausted!")
+
+    def __remove_waiter(
+        self, name: str, loop: AbstractEventLoop, waiter: "asyncio.Future[None]"
+    ) -> None:
+        loop_waiters = self.__waiters.get(name, {})
+        waiters = loop_waiters.get(loop)
+        if waiters is None:
+            return
+        if waiter in waiters:
+            waiters.remove(waiter)
+        if not waiters:
+            del loop_waiters[loop]
 
     async def async_recycle(
         self,
@@ -360,11 +1199,9 @@ class Pond(object):
         factory: Optional[PooledObjectFactory] = None,
         name: Optional[str] = None,
     ) -> None:
-        async with self.__async_lock:
-            self.recycle(pooled_object=pooled_object, factory=factory, name=name)
+        self.recycle(pooled_object=pooled_object, factory=factory, name=name)
 
     async def async_clear(
         self, factory: Optional[PooledObjectFactory] = None, name: Optional[str] = None
     ) -> None:
-        async with self.__async_lock:
-            self.clear(factory=factory, name=name)
+        self.clear(factory=factory, name=name)
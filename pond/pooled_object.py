@@ -16,18 +16,20 @@ limitations under the License.
 from __future__ import annotations
 
 import time
-from typing import Any
+from typing import Any, Hashable, Optional
 
 
 class PooledObject:
     create_time: float
     last_borrow_time: float
     keeped_object: Any
+    affinity: Optional[Hashable]
 
     def __init__(self, obj: Any) -> None:
         self.create_time = time.time()
         self.last_borrow_time = time.time()
         self.keeped_object = obj
+        self.affinity = None
 
     def use(self) -> Any:
         return self.keeped_object
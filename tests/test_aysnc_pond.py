@@ -1,4 +1,5 @@
 import asyncio
+import threading
 import time
 
 import pytest
@@ -48,3 +49,56 @@ async def test_async_borrow_and_recycle() -> None:
     assert pooled_object.keeped_object is dog
     await pond.async_recycle(pooled_object, factory)
     assert pond.pooled_object_size(factory) == pooled_maxsize
+
+
+def test_async_borrow_from_many_loops() -> None:
+    shared_pond = Pond(time_between_eviction_runs=-1)
+    shared_pond.register(factory, name="shared")
+
+    async def worker() -> None:
+        for i in range(200):
+            pooled_object = await shared_pond.async_borrow(name="shared", timeout=1)
+            await asyncio.sleep(0)
+            await shared_pond.async_recycle(pooled_object, name="shared")
+
+    threads = [threading.Thread(target=asyncio.run, args=(worker(),)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert shared_pond.pooled_object_size(name="shared") == pooled_maxsize
+    shared_pond.stop()
+
+
+async def test_async_borrow_waits_for_recycle() -> None:
+    waiting_pond = Pond(time_between_eviction_runs=-1)
+    waiting_pond.register(factory, name="waiting")
+    pooled_objects = [
+        waiting_pond.borrow(name="waiting") for i in range(pooled_maxsize)
+    ]
+    returned_object = pooled_objects[0]
+    timer = threading.Timer(
+        0.1, waiting_pond.recycle, args=(returned_object,), kwargs={"name": "waiting"}
+    )
+    timer.start()
+    start = time.time()
+    pooled_object = await waiting_pond.async_borrow(name="waiting", timeout=5)
+    assert pooled_object is returned_object
+    assert time.time() - start < 5
+
+    pooled_object = await waiting_pond.async_borrow(name="waiting", timeout=0.1)
+    assert pooled_object not in pooled_objects
+    waiting_pond.stop()
+
+
+async def test_async_borrow_wakes_on_warm_up() -> None:
+    warming_pond = Pond(time_between_eviction_runs=-1)
+    warming_pond.register(factory, name="warming", prefill=False)
+    timer = threading.Timer(0.1, warming_pond.warm_up)
+    timer.start()
+    start = time.time()
+    pooled_object = await warming_pond.async_borrow(name="warming", timeout=5)
+    assert pooled_object
+    assert time.time() - start < 5
+    timer.join()
+    warming_pond.stop()
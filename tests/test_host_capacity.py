@@ -0,0 +1,151 @@
+import multiprocessing
+
+import pytest
+
+from pond import HostCapacity, Pond, PooledObject, PooledObjectFactory
+
+
+class Dog:
+    name: str
+    validate_result: bool = True
+
+
+class PooledDogFactory(PooledObjectFactory):
+    def createInstance(self) -> PooledObject:
+        dog = Dog()
+        dog.name = "puppy"
+        return PooledObject(dog)
+
+    def destroy(self, pooled_object: PooledObject) -> None:
+        del pooled_object
+
+    def reset(self, pooled_object: PooledObject) -> PooledObject:
+        pooled_object.keeped_object.name = "puppy"
+        return pooled_object
+
+    def validate(self, pooled_object: PooledObject) -> bool:
+        return pooled_object.keeped_object.validate_result
+
+
+pooled_maxsize = 10
+factory = PooledDogFactory(pooled_maxsize=pooled_maxsize, least_one=False)
+
+
+def fill_worker(path: str, limit: int, sizes, barrier) -> None:
+    worker_pond = Pond(time_between_eviction_runs=-1)
+    worker_pond.register(factory, host_capacity=HostCapacity(path, limit))
+    sizes.put(worker_pond.pooled_object_size(factory))
+    barrier.wait()
+
+
+def borrow_worker(path: str, limit: int) -> None:
+    worker_pond = Pond(time_between_eviction_runs=-1)
+    worker_pond.register(
+        factory, prefill=False, host_capacity=HostCapacity(path, limit, timeout=10)
+    )
+    worker_pond.borrow(factory)
+
+
+def test_host_capacity_across_processes(tmp_path) -> None:
+    path = str(tmp_path / "dog.capacity")
+    limit = 12
+    sizes = multiprocessing.Queue()
+    barrier = multiprocessing.Barrier(5)
+    processes = [
+        multiprocessing.Process(target=fill_worker, args=(path, limit, sizes, barrier))
+        for i in range(4)
+    ]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    assert sum(sizes.get() for i in range(4)) == limit
+    assert HostCapacity(path, limit).in_use() == limit
+    for process in processes:
+        process.join()
+    assert HostCapacity(path, limit).in_use() == 0
+
+
+def test_host_capacity_exhausted(tmp_path) -> None:
+    capacity = HostCapacity(str(tmp_path / "dog.capacity"), limit=2, timeout=0.05)
+    capacity_pond = Pond(time_between_eviction_runs=-1)
+    capacity_pond.register(factory, host_capacity=capacity)
+    assert capacity_pond.pooled_object_size(factory) == 2
+    pooled_objects = [capacity_pond.borrow(factory) for i in range(2)]
+    with pytest.raises(RuntimeError):
+        capacity_pond.borrow(factory)
+    capacity_pond.recycle(pooled_objects.pop(), factory)
+    assert capacity_pond.borrow(factory)
+    capacity_pond.stop()
+
+
+def test_host_capacity_rebalance(tmp_path) -> None:
+    path = str(tmp_path / "dog.capacity")
+    capacity_pond = Pond(time_between_eviction_runs=-1)
+    capacity_pond.register(factory, host_capacity=HostCapacity(path, limit=2))
+    assert capacity_pond.pooled_object_size(factory) == 2
+    process = multiprocessing.Process(target=borrow_worker, args=(path, 2))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert capacity_pond.pooled_object_size(factory) <= 1
+    capacity_pond.stop()
+
+
+class CountingCapacity(HostCapacity):
+    attempts = 0
+
+    def acquire(self, n: int = 1) -> bool:
+        self.attempts += 1
+        return super().acquire(n)
+
+
+def test_host_capacity_backs_off(tmp_path) -> None:
+    capacity = CountingCapacity(str(tmp_path / "dog.capacity"), limit=1, timeout=1)
+    capacity_pond = Pond(time_between_eviction_runs=-1)
+    capacity_pond.register(factory, host_capacity=capacity)
+    capacity_pond.borrow(factory)
+    capacity.attempts = 0
+    with pytest.raises(RuntimeError):
+        capacity_pond.borrow(factory)
+    assert capacity.attempts < 10
+
+
+def test_host_capacity_ignores_corrupt_file(tmp_path) -> None:
+    path = tmp_path / "dog.capacity"
+    path.write_bytes(b'{"1": {"he')
+    capacity = HostCapacity(str(path), limit=1)
+    assert capacity.in_use() == 0
+    assert capacity.acquire()
+    assert capacity.in_use() == 1
+
+
+def test_unregister_releases_host_capacity(tmp_path) -> None:
+    capacity = HostCapacity(str(tmp_path / "dog.capacity"), limit=2)
+    capacity_pond = Pond(time_between_eviction_runs=-1)
+    capacity_pond.register(factory, host_capacity=capacity)
+    pooled_object = capacity_pond.borrow(factory)
+    assert capacity.in_use() == 2
+    capacity_pond.unregister(factory, drain=False)
+    assert capacity.in_use() == 0
+    with pytest.raises(ValueError):
+        capacity_pond.recycle(pooled_object, factory)
+
+
+class ResetFailingDogFactory(PooledDogFactory):
+    def reset(self, pooled_object: PooledObject) -> PooledObject:
+        raise RuntimeError("The dog refuses to sit!")
+
+
+def test_recycle_destroys_when_reset_fails(tmp_path) -> None:
+    capacity = HostCapacity(str(tmp_path / "dog.capacity"), limit=2)
+    capacity_pond = Pond(time_between_eviction_runs=-1)
+    capacity_pond.register(
+        ResetFailingDogFactory(pooled_maxsize=2), name="reset", host_capacity=capacity
+    )
+    pooled_object = capacity_pond.borrow(name="reset")
+    with pytest.raises(RuntimeError):
+        capacity_pond.recycle(pooled_object, name="reset")
+    stats = capacity_pond.stats(name="reset")
+    assert stats["idle"] == 1
+    assert stats["leased"] == 0
+    assert capacity.in_use() == 1
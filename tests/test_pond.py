@@ -1,4 +1,6 @@
+import threading
 import time
+from typing import List
 
 import pytest
 
@@ -169,3 +171,244 @@ def test_clear() -> None:
 @pytest.mark.run(order=999)
 def test_stop() -> None:
     pond.stop()
+
+
+def test_snapshot_warm_restart(tmp_path) -> None:
+    snapshot_path = str(tmp_path / "pond.snapshot")
+    least_one_factory = PooledDogFactory(pooled_maxsize=4, least_one=True)
+    first = Pond(time_between_eviction_runs=-1, snapshot_path=snapshot_path)
+    first.register(factory, name="hot")
+    first.register(factory, name="cold")
+    first.register(least_one_factory, name="least_one")
+    hot_objects = [first.borrow(name="hot") for i in range(pooled_maxsize - 3)]
+    cold_objects = [first.borrow(name="cold") for i in range(3)]
+    first.clear(name="cold")
+    for pooled_object in cold_objects:
+        first.recycle(pooled_object, name="cold")
+    first.clear(name="least_one")
+    first.counter.sketch["hot"] = 5
+    first.save_snapshot()
+    assert len(hot_objects) == first.stats(name="hot")["leased"]
+
+    second = Pond(time_between_eviction_runs=-1, snapshot_path=snapshot_path)
+    assert second.load_snapshot() == {
+        "hot": {"size": pooled_maxsize, "count": 5},
+        "cold": {"size": 3, "count": 0},
+        "least_one": {"size": 0, "count": 0},
+    }
+    second.register(factory, name="cold", prefill=False)
+    second.register(factory, name="hot", prefill=False)
+    second.register(least_one_factory, name="least_one", prefill=False)
+    assert second.count_total_objects() == 0
+    second.warm_up()
+    assert second.pooled_object_size(name="hot") == pooled_maxsize
+    assert second.pooled_object_size(name="cold") == 3
+    assert second.pooled_object_size(name="least_one") == 1
+
+
+@pytest.mark.parametrize(
+    "content", [b"{", b'{"version": 999, "pools": {"hot": {"size": 1, "count": 0}}}']
+)
+def test_snapshot_ignored_when_invalid(tmp_path, content: bytes) -> None:
+    snapshot_path = tmp_path / "pond.snapshot"
+    snapshot_path.write_bytes(content)
+    invalid_pond = Pond(time_between_eviction_runs=-1, snapshot_path=str(snapshot_path))
+    assert invalid_pond.load_snapshot() == {}
+    invalid_pond.register(factory, name="hot")
+    assert invalid_pond.pooled_object_size(name="hot") == pooled_maxsize
+
+
+def test_background_recycle() -> None:
+    background_pond = Pond(
+        borrowed_timeout=2,
+        time_between_eviction_runs=-1,
+        background_recycle=True,
+        recycle_queue_maxsize=2,
+    )
+    background_pond.register(factory, name="background")
+    pooled_objects = [background_pond.borrow(name="background") for i in range(4)]
+    for pooled_object in pooled_objects:
+        pooled_object.keeped_object.name = "dinosaurs"
+        background_pond.recycle(pooled_object, name="background", new_name="cat")
+    background_pond.join_recycle()
+    assert background_pond.pooled_object_size(name="background") == pooled_maxsize
+    pooled_object = background_pond.borrow(name="background")
+    assert pooled_object.keeped_object.name == "cat"
+
+    pooled_object.keeped_object.validate_result = False
+    background_pond.recycle(pooled_object, name="background")
+    background_pond.join_recycle()
+    pooled_object = background_pond.borrow(name="background")
+    assert pooled_object.keeped_object.validate_result
+    background_pond.join_recycle()
+    assert background_pond.pooled_object_size(name="background") == pooled_maxsize - 2
+    background_pond.stop()
+    assert background_pond.pooled_object_size(name="background") == 0
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_resize() -> None:
+    resize_pond = Pond(time_between_eviction_runs=-1)
+    resize_pond.register(factory, name="resize")
+    pooled_object = resize_pond.borrow(name="resize")
+    resize_pond.resize(name="resize", maxsize=4)
+    assert wait_for(lambda: resize_pond.pooled_object_size(name="resize") == 4)
+    resize_pond.recycle(pooled_object, name="resize")
+    assert resize_pond.pooled_object_size(name="resize") == 4
+
+    resize_pond.clear(name="resize")
+    resize_pond.resize(name="resize", maxsize=6, min_idle=3)
+    assert wait_for(lambda: resize_pond.pooled_object_size(name="resize") == 3)
+    with pytest.raises(ValueError):
+        resize_pond.resize(name="resize", maxsize=2, min_idle=3)
+    with pytest.raises(ValueError):
+        resize_pond.resize(name="Notfound", maxsize=2)
+    resize_pond.stop()
+
+
+def test_unregister() -> None:
+    unregister_pond = Pond(time_between_eviction_runs=-1)
+    unregister_pond.register(factory, name="drain")
+    unregister_pond.register(factory, name="forget")
+    drained_object = unregister_pond.borrow(name="drain")
+    forgotten_object = unregister_pond.borrow(name="forget")
+    unregister_pond.unregister(name="drain")
+    unregister_pond.unregister(name="forget", drain=False)
+    assert unregister_pond.size() == 0
+    assert unregister_pond.count_total_objects() == 0
+    unregister_pond.recycle(drained_object, name="drain")
+    with pytest.raises(ValueError):
+        unregister_pond.recycle(drained_object, name="drain")
+    with pytest.raises(ValueError):
+        unregister_pond.recycle(forgotten_object, name="forget")
+    with pytest.raises(ValueError):
+        unregister_pond.unregister(name="drain")
+    unregister_pond.register(factory, name="drain")
+    assert unregister_pond.pooled_object_size(name="drain") == pooled_maxsize
+
+
+def test_unregister_ignores_stray_recycle() -> None:
+    stray_pond = Pond(time_between_eviction_runs=-1)
+    stray_pond.register(factory, name="stray")
+    borrowed_object = stray_pond.borrow(name="stray")
+    stray_pond.recycle(factory.createInstance(), name="stray")
+    assert stray_pond.stats(name="stray")["leased"] == 1
+    stray_pond.unregister(name="stray")
+    with pytest.raises(ValueError):
+        stray_pond.recycle(factory.createInstance(), name="stray")
+    stray_pond.recycle(borrowed_object, name="stray")
+    with pytest.raises(ValueError):
+        stray_pond.recycle(borrowed_object, name="stray")
+
+
+class NamedDogFactory(PooledDogFactory):
+    def __init__(self, dog_name: str) -> None:
+        super().__init__(pooled_maxsize=2, least_one=False)
+        self.dog_name = dog_name
+        self.destroyed: List[str] = []
+
+    def createInstance(self) -> PooledObject:
+        pooled_object = super().createInstance()
+        pooled_object.keeped_object.name = self.dog_name
+        return pooled_object
+
+    def destroy(self, pooled_object: PooledObject) -> None:
+        self.destroyed.append(pooled_object.keeped_object.name)
+
+    def reset(self, pooled_object: PooledObject) -> PooledObject:
+        return pooled_object
+
+
+def test_register_again_while_draining() -> None:
+    reload_pond = Pond(time_between_eviction_runs=-1)
+    old_factory = NamedDogFactory("old")
+    new_factory = NamedDogFactory("new")
+    reload_pond.register(old_factory, name="reload")
+    old_object = reload_pond.borrow(name="reload")
+    reload_pond.unregister(name="reload")
+    reload_pond.register(new_factory, name="reload")
+    reload_pond.recycle(old_object, name="reload")
+    assert old_factory.destroyed == ["old", "old"]
+    assert new_factory.destroyed == []
+    dogs = [reload_pond.borrow(name="reload").use().name for i in range(3)]
+    assert dogs == ["new", "new", "new"]
+
+
+class FlakyDogFactory(PooledDogFactory):
+    failures = 1
+
+    def createInstance(self) -> PooledObject:
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("The dog is not ready!")
+        return super().createInstance()
+
+
+def test_resize_after_adjuster_failure(caplog) -> None:
+    flaky_pond = Pond(time_between_eviction_runs=-1)
+    flaky_pond.register(FlakyDogFactory(pooled_maxsize=5), name="flaky", prefill=False)
+    flaky_pond.resize(name="flaky", min_idle=3)
+    assert wait_for(lambda: "Failed to resize the pool of flaky" in caplog.text)
+    assert wait_for(lambda: not flaky_pond._Pond__adjusting)  # type: ignore
+    flaky_pond.resize(name="flaky", min_idle=3)
+    assert wait_for(lambda: flaky_pond.pooled_object_size(name="flaky") == 3)
+
+
+def test_resize_single_adjuster() -> None:
+    adjuster_pond = Pond(time_between_eviction_runs=-1)
+    adjuster_pond.register(factory, name="adjust", prefill=False)
+    threads = threading.active_count()
+    for i in range(50):
+        adjuster_pond.resize(name="adjust", maxsize=pooled_maxsize, min_idle=i % 5)
+    assert threading.active_count() <= threads + 1
+
+
+def test_borrow_with_affinity() -> None:
+    affinity_pond = Pond(time_between_eviction_runs=-1)
+    affinity_pond.register(factory, name="affinity")
+    tenant_a = affinity_pond.borrow(name="affinity", affinity="tenant-a")
+    tenant_b = affinity_pond.borrow(name="affinity", affinity="tenant-b")
+    affinity_pond.recycle(tenant_a, name="affinity")
+    affinity_pond.recycle(tenant_b, name="affinity")
+    assert affinity_pond.borrow(name="affinity", affinity="tenant-a") is tenant_a
+    tenant_c = affinity_pond.borrow(name="affinity", affinity="tenant-c")
+    assert tenant_c is not tenant_b
+    assert affinity_pond.borrow(name="affinity", affinity="tenant-b") is tenant_b
+    tenant_a.keeped_object.validate_result = False
+    affinity_pond.recycle(tenant_a, name="affinity")
+    pooled_object = affinity_pond.borrow(name="affinity", affinity="tenant-a")
+    assert pooled_object is not tenant_a
+
+    stats = affinity_pond.stats(name="affinity")
+    assert stats["idle"] == pooled_maxsize - 4
+    assert stats["leased"] == 3
+    assert stats["affinity_requests"] == 6
+    assert stats["affinity_hits"] == 2
+    assert stats["affinity_hit_rate"] == 2 / 6
+    affinity_pond.stop()
+
+
+class BrokenDogFactory(PooledDogFactory):
+    def destroy(self, pooled_object: PooledObject) -> None:
+        raise RuntimeError("The dog refuses to leave!")
+
+
+def test_background_recycle_logs_destroy_errors(caplog) -> None:
+    background_pond = Pond(
+        borrowed_timeout=2, time_between_eviction_runs=-1, background_recycle=True
+    )
+    background_pond.register(BrokenDogFactory(pooled_maxsize=1), name="broken")
+    pooled_objects = [background_pond.borrow(name="broken") for i in range(2)]
+    for pooled_object in pooled_objects:
+        background_pond.recycle(pooled_object, name="broken")
+    background_pond.join_recycle()
+    assert "Failed to destroy a pooled object of broken" in caplog.text
+    assert background_pond.pooled_object_size(name="broken") == 1
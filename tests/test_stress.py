@@ -0,0 +1,165 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List, Set
+
+import pytest
+
+from pond import Pond, PooledObject, PooledObjectFactory
+
+
+class Dog:
+    name: str
+
+
+class CountingDogFactory(PooledObjectFactory):
+    def __init__(self, pooled_maxsize: int = 8, least_one: bool = False) -> None:
+        super().__init__(pooled_maxsize=pooled_maxsize, least_one=least_one)
+        self.lock = threading.Lock()
+        self.created: List[Dog] = []
+        self.destroyed: Counter = Counter()
+
+    def createInstance(self) -> PooledObject:
+        dog = Dog()
+        dog.name = "puppy"
+        with self.lock:
+            self.created.append(dog)
+        return PooledObject(dog)
+
+    def destroy(self, pooled_object: PooledObject) -> None:
+        with self.lock:
+            self.destroyed[id(pooled_object.keeped_object)] += 1
+
+    def reset(self, pooled_object: PooledObject) -> PooledObject:
+        pooled_object.keeped_object.name = "puppy"
+        return pooled_object
+
+    def validate(self, pooled_object: PooledObject) -> bool:
+        return True
+
+
+def gil_enabled() -> bool:
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+
+def run_threads(n: int, target) -> None:
+    threads = [threading.Thread(target=target) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class Borrowed(object):
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.dogs: Set[int] = set()
+
+    def add(self, dog: Dog) -> bool:
+        with self.lock:
+            if id(dog) in self.dogs:
+                return False
+            self.dogs.add(id(dog))
+            return True
+
+    def remove(self, dog: Dog) -> None:
+        with self.lock:
+            self.dogs.discard(id(dog))
+
+
+def borrow_and_recycle(
+    pond: Pond,
+    name: str,
+    borrowed: Borrowed,
+    errors: List[str],
+    rounds: int,
+    hold: bool = False,
+) -> None:
+    for i in range(rounds):
+        pooled_object = pond.borrow(name=name)
+        dog = pooled_object.use()
+        if not borrowed.add(dog):
+            errors.append("The same object was borrowed twice!")
+        if hold:
+            time.sleep(0)
+        borrowed.remove(dog)
+        pond.recycle(pooled_object, name=name)
+
+
+@pytest.mark.parametrize("background_recycle", [False, True])
+def test_no_object_lost_or_destroyed_twice(background_recycle: bool) -> None:
+    factory = CountingDogFactory(pooled_maxsize=8)
+    pond = Pond(
+        borrowed_timeout=60,
+        time_between_eviction_runs=-1,
+        background_recycle=background_recycle,
+    )
+    pond.register(factory, name="stress")
+    borrowed = Borrowed()
+    errors: List[str] = []
+    stopped = threading.Event()
+
+    def worker() -> None:
+        borrow_and_recycle(pond, "stress", borrowed, errors, 2000, hold=True)
+
+    def meddler() -> None:
+        while not stopped.is_set():
+            pond.clear(name="stress")
+            pond.resize(name="stress", maxsize=random.randint(1, 8))
+            time.sleep(0.001)
+
+    meddler_thread = threading.Thread(target=meddler)
+    meddler_thread.start()
+    run_threads(8, worker)
+    stopped.set()
+    meddler_thread.join()
+    pond.join_recycle()
+    pond.resize(name="stress", maxsize=8)
+    time.sleep(0.1)
+    pond.stop()
+
+    assert errors == []
+    assert max(factory.destroyed.values()) == 1
+    assert len(factory.destroyed) == len(factory.created)
+
+
+@pytest.mark.skipif(
+    not os.environ.get("POND_BENCHMARK"), reason="set POND_BENCHMARK=1 to run"
+)
+@pytest.mark.parametrize("shared", [False, True])
+def test_borrow_throughput_scaling(shared: bool) -> None:
+    rounds = 5000
+    results = []
+    thread_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    for n in thread_counts:
+        factory = CountingDogFactory(pooled_maxsize=n)
+        pond = Pond(time_between_eviction_runs=-1)
+        names = ["scaling"] * n if shared else ["scaling-%d" % i for i in range(n)]
+        for name in set(names):
+            pond.register(factory, name=name)
+        borrowed = Borrowed()
+        errors: List[str] = []
+        workers = iter(names)
+
+        def worker() -> None:
+            borrow_and_recycle(pond, next(workers), borrowed, errors, rounds)
+
+        start = time.perf_counter()
+        run_threads(n, worker)
+        elapsed = time.perf_counter() - start
+        pond.stop()
+        assert errors == []
+        results.append((n, n * rounds / elapsed))
+    print(
+        "\nborrow throughput, %s (GIL %s):"
+        % (
+            "shared pool" if shared else "pool per thread",
+            "on" if gil_enabled() else "off",
+        )
+    )
+    for n, throughput in results:
+        print("  %3d threads: %10.0f borrows/s" % (n, throughput))